@@ -4,9 +4,16 @@ import pandas as pd
 import uuid
 from datetime import datetime
 from google.cloud import texttospeech
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import TextToSpeechGrpcTransport
 import google.api_core.exceptions
 import sys
 import os
+import threading
+import time
+from credentials_manager import get_shared_credentials
+from record_summary import RecordSummary, sorted_positions
+from snapshot_store import load_snapshot, save_snapshot, table_fingerprint
+from voice_catalog import load_voice_catalog, language_label, find_language_index, find_voice_index, estimate_cost
 
 # エンコーディングの設定を最初に行う
 if hasattr(sys.stdout, 'reconfigure'):
@@ -18,6 +25,13 @@ if hasattr(sys.stderr, 'reconfigure'):
 os.environ['PYTHONIOENCODING'] = 'utf-8'
 os.environ['PYTHONUTF8'] = '1'
 
+# ページ設定（他のStreamlitコマンドより先に呼び出す必要がある）
+st.set_page_config(
+    page_title="音声生成CRUDアプリ",
+    page_icon="🎵",
+    layout="wide"
+)
+
 # 重要: st-gsheets-connectionを明示的にインポート
 try:
     from streamlit_gsheets import GSheetsConnection
@@ -26,13 +40,6 @@ except ImportError as e:
     st.error(f"❌ st-gsheets-connection のインポートに失敗: {e}")
     st.stop()
 
-# ページ設定
-st.set_page_config(
-    page_title="音声生成CRUDアプリ",
-    page_icon="🎵",
-    layout="wide"
-)
-
 # Google Sheets接続の初期化
 @st.cache_resource
 def init_gsheets_connection():
@@ -59,69 +66,20 @@ def init_gsheets_connection():
         st.write(f"🔍 エラーの詳細: {type(e).__name__}")
         return None
 
+# Text-to-Speech APIの接続先
+TTS_ENDPOINT = "texttospeech.googleapis.com:443"
+
 # Text-to-Speech クライアントの初期化
 @st.cache_resource
 def init_tts_client():
     """Text-to-Speech クライアントを初期化"""
     try:
-        # Google Sheetsの接続情報から実際のサービスアカウント認証情報を取得
-        gsheets_info = st.secrets["connections"]["gsheets"]
-        
-        # サービスアカウント情報から認証情報を作成
-        from google.oauth2 import service_account
-        import json
-        
-        # 認証情報を取得する（サーバーとローカルで構造が異なる）
-        credentials_dict = None
-        
-        # パターン1: credentialsサブセクションがある場合（ローカル）
-        if 'credentials' in gsheets_info:
-            try:
-                credentials_info = gsheets_info['credentials']
-                if hasattr(credentials_info, 'to_dict'):
-                    credentials_dict = credentials_info.to_dict()
-                elif hasattr(credentials_info, '_data'):
-                    credentials_dict = dict(credentials_info._data)
-                else:
-                    credentials_dict = dict(credentials_info)
-                st.write("🔍 credentialsサブセクションから認証情報を取得しました")
-            except Exception as e:
-                st.write(f"🔍 credentialsサブセクションアクセスエラー: {e}")
-        
-        # パターン2: 直接gsheets_infoにサービスアカウント情報がある場合（サーバー）
-        if credentials_dict is None:
-            try:
-                # 必要なキーが直接存在するかチェック
-                required_keys = ['client_email', 'private_key', 'project_id']
-                if all(key in gsheets_info for key in required_keys):
-                    credentials_dict = dict(gsheets_info)
-                    st.write("🔍 直接アクセスから認証情報を取得しました")
-                else:
-                    missing_keys = [key for key in required_keys if key not in gsheets_info]
-                    st.write(f"🔍 必要なキーが不足: {missing_keys}")
-            except Exception as e:
-                st.write(f"🔍 直接アクセスエラー: {e}")
-        
-        if credentials_dict is None:
-            raise ValueError("認証情報を取得できませんでした")
-        
-        # 認証情報をログ出力（プライベートキーは除外）
-        safe_keys = [k for k in credentials_dict.keys() if k != 'private_key']
-        st.write(f"🔍 取得した認証情報のキー: {safe_keys}")
-        
-        # 必要なキーの存在確認
-        required_keys = ['client_email', 'private_key', 'project_id']
-        missing_keys = [key for key in required_keys if key not in credentials_dict]
-        if missing_keys:
-            raise ValueError(f"必要なキーが不足しています: {missing_keys}")
-        
-        # Text-to-Speech用のスコープを設定
-        credentials = service_account.Credentials.from_service_account_info(
-            credentials_dict,
-            scopes=['https://www.googleapis.com/auth/cloud-platform']
-        )
+        # 共有の認証情報（secretsの解析とトークン更新は一度だけ行う）
+        shared = get_shared_credentials()
         
-        client = texttospeech.TextToSpeechClient(credentials=credentials)
+        # 共有のgRPCチャネルを使ってクライアントを作成
+        transport = TextToSpeechGrpcTransport(channel=shared.grpc_channel(TTS_ENDPOINT))
+        client = texttospeech.TextToSpeechClient(transport=transport)
         st.write("✅ Text-to-Speech クライアントが正常に初期化されました")
         return client
             
@@ -150,16 +108,113 @@ def init_tts_client():
         
         return None
 
+# 読み込み対象のワークシート
+WORKSHEET_NAME = "シート1"
+
+# シート読み込みのキャッシュ期間（秒）
+READ_TTL = 5
+
+# スナップショットの同期状態（プロセス内で共有）
+@st.cache_resource
+def init_snapshot_state():
+    """スナップショットの同期状態を初期化"""
+    return {
+        "lock": threading.Lock(),
+        "reconciling": False,
+        "reconciled": False,
+        "fingerprint": None,
+        # このプロセスで最後にシートへ書き込んだ時刻
+        "written_at": 0.0
+    }
+
+def read_sheet(conn, ttl=READ_TTL):
+    """シートを読み込んで整形する（画面には何も出力しない、ttl=0でキャッシュを使わない）"""
+    df = conn.read(worksheet=WORKSHEET_NAME, usecols=list(range(7)), ttl=ttl)
+    
+    if not df.empty:
+        # データの内容は文字化けを避けるため、そのまま返す
+        # Streamlitのdataframeコンポーネントが適切に日本語を表示する
+        for col in df.columns:
+            if df[col].dtype == 'object':
+                # NaNを空文字に変換
+                df[col] = df[col].fillna('')
+    
+    return df.dropna(how='all')
+
+def persist_snapshot(df, fingerprint=None, state=None, read_at=None):
+    """最新のデータをスナップショットとして保存（read_atは読み込んだ時刻、書き込んだデータの場合はNone）"""
+    # バックグラウンドのスレッドからはキャッシュ関数を呼ばず、取得済みの状態を渡す
+    state = state or init_snapshot_state()
+    fingerprint = fingerprint or table_fingerprint(df)
+    with state["lock"]:
+        if read_at is None:
+            state["written_at"] = time.time()
+        elif read_at < state["written_at"]:
+            # 書き込みより前に読んだデータで新しいスナップショットを上書きしない
+            return
+        if fingerprint == state["fingerprint"]:
+            return
+        try:
+            save_snapshot(df, WORKSHEET_NAME, fingerprint)
+            state["fingerprint"] = fingerprint
+        except Exception as e:
+            # 失敗しても処理は続行する
+            print(f"スナップショットの保存に失敗しました: {e}")
+
+def reconcile_in_background(conn):
+    """バックグラウンドでシートを読み込み、スナップショットを最新化"""
+    state = init_snapshot_state()
+    with state["lock"]:
+        if state["reconciling"] or state["reconciled"]:
+            return
+        state["reconciling"] = True
+    
+    def run():
+        try:
+            read_at = time.time()
+            persist_snapshot(read_sheet(conn, ttl=0), state=state, read_at=read_at)
+            state["reconciled"] = True
+        except Exception as e:
+            # 次回の再実行時に再試行する
+            print(f"シートとの同期に失敗しました: {e}")
+        finally:
+            state["reconciling"] = False
+    
+    threading.Thread(target=run, name="snapshot-reconcile", daemon=True).start()
+
+# レコードの集計（プロセス内で共有し、追加・更新・削除時に差分更新する）
+@st.cache_resource
+def init_record_summary():
+    """レコードの集計を初期化"""
+    return RecordSummary()
+
 # データベース操作関数
-def get_all_records(conn):
-    """すべてのレコードを取得"""
+def get_all_records(conn, allow_snapshot=True, ttl=None):
+    """すべてのレコードを取得（ttl=0でキャッシュを使わずに読み込む）"""
+    # 起動直後はスナップショットから即座に表示し、シートとはバックグラウンドで同期する
+    state = init_snapshot_state()
+    if allow_snapshot and not state["reconciled"]:
+        snapshot_df, meta = load_snapshot(WORKSHEET_NAME)
+        if snapshot_df is not None:
+            # 同じ内容のスナップショットを書き直さないよう、保存済みのウォーターマークを覚えておく
+            with state["lock"]:
+                if state["fingerprint"] is None:
+                    state["fingerprint"] = meta.get("fingerprint")
+            reconcile_in_background(conn)
+            snapshot_df.attrs["fingerprint"] = meta.get("fingerprint")
+            st.caption(f"💾 {meta['synced_at']} 時点のスナップショットを表示しています（バックグラウンドで同期中）")
+            return snapshot_df
+    
+    # 書き込み直後はキャッシュに書き込み前のデータが残っているため、キャッシュを使わずに読む
+    if ttl is None:
+        ttl = 0 if time.time() - state["written_at"] < READ_TTL else READ_TTL
+    
     try:
-        # シート名を明示的に指定
-        worksheet_name = "シート1"
-        
         # まず最小限のデータ取得を試行
+        # キャッシュの内容は最大でttl秒前のものなので、その時刻に読んだものとして扱う
+        read_at = time.time() - ttl
         with st.spinner("データを読み込み中..."):
-            df = conn.read(worksheet=worksheet_name, usecols=list(range(7)), ttl=5)
+            df = read_sheet(conn, ttl)
         
         # デバッグ情報を最小限に抑制
         st.write(f"Data shape: {df.shape}")
@@ -167,15 +222,13 @@ def get_all_records(conn):
         if not df.empty:
             # カラム名を表示
             st.write(f"Columns: {list(df.columns)}")
-            
-            # データの内容は文字化けを避けるため、そのまま返す
-            # Streamlitのdataframeコンポーネントが適切に日本語を表示する
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    # NaNを空文字に変換
-                    df[col] = df[col].fillna('')
         
-        return df.dropna(how='all')
+        # 内容が変わった場合のみスナップショットを更新
+        fingerprint = table_fingerprint(df)
+        persist_snapshot(df, fingerprint, read_at=read_at)
+        df.attrs["fingerprint"] = fingerprint
+        
+        return df
         
     except Exception as e:
         # エラーメッセージを安全に表示
@@ -194,7 +247,7 @@ def add_record(conn, record):
     """新しいレコードを追加"""
     try:
         # 既存データを取得
-        existing_df = get_all_records(conn)
+        existing_df = get_all_records(conn, allow_snapshot=False, ttl=0)
         
         # 新しいレコードをDataFrameに変換
         new_df = pd.DataFrame([record])
@@ -206,49 +259,77 @@ def add_record(conn, record):
             updated_df = pd.concat([existing_df, new_df], ignore_index=True)
         
         # スプレッドシートを更新
-        conn.update(worksheet="シート1", data=updated_df)
+        conn.update(worksheet=WORKSHEET_NAME, data=updated_df)
+        fingerprint = table_fingerprint(updated_df)
+        persist_snapshot(updated_df, fingerprint)
+        init_record_summary().apply_add(record, fingerprint)
         return True
     except Exception as e:
         st.error(f"データの追加に失敗しました: {str(e)}")
         return False
 
+def locate_record(df, index, record):
+    """最新のデータ上で対象レコードの位置を取得（見つからない場合はNone）"""
+    # 画面のデータはスナップショットなど古い可能性があるため、idで特定する
+    record_id = record.get('id', '')
+    if 'id' in df.columns and not pd.isna(record_id) and str(record_id):
+        positions = (df['id'].astype(str) == str(record_id)).to_numpy().nonzero()[0]
+        return int(positions[0]) if len(positions) else None
+    
+    # idがない行は位置で特定し、作成日時が一致する場合のみ対象とする
+    if index < len(df) and str(df.iloc[index].get('created_at', '')) == str(record.get('created_at', '')):
+        return index
+    return None
+
 def update_record(conn, index, record):
     """特定のレコードを更新"""
     try:
         # 既存データを取得
-        df = get_all_records(conn)
+        df = get_all_records(conn, allow_snapshot=False, ttl=0)
+        position = locate_record(df, index, record)
         
-        if index < len(df):
-            # 指定されたインデックスの行を更新
+        if position is not None:
+            old_record = df.iloc[position].to_dict()
+            
+            # 対象の行を更新
             for key, value in record.items():
                 if key in df.columns:
-                    df.at[index, key] = value
+                    df.iloc[position, df.columns.get_loc(key)] = value
             
             # スプレッドシートを更新
-            conn.update(worksheet="シート1", data=df)
+            conn.update(worksheet=WORKSHEET_NAME, data=df)
+            fingerprint = table_fingerprint(df)
+            persist_snapshot(df, fingerprint)
+            init_record_summary().apply_update(old_record, record, fingerprint)
             return True
         else:
-            st.error("指定されたインデックスが範囲外です")
+            st.error("対象のデータが見つかりません。他の場所で変更された可能性があります。")
             return False
     except Exception as e:
         st.error(f"データの更新に失敗しました: {str(e)}")
         return False
 
-def delete_record(conn, index):
+def delete_record(conn, index, record):
     """特定のレコードを削除"""
     try:
         # 既存データを取得
-        df = get_all_records(conn)
+        df = get_all_records(conn, allow_snapshot=False, ttl=0)
+        position = locate_record(df, index, record)
         
-        if index < len(df):
-            # 指定されたインデックスの行を削除
-            df = df.drop(df.index[index]).reset_index(drop=True)
+        if position is not None:
+            old_record = df.iloc[position].to_dict()
+            
+            # 対象の行を削除
+            df = df.drop(df.index[position]).reset_index(drop=True)
             
             # スプレッドシートを更新
-            conn.update(worksheet="シート1", data=df)
+            conn.update(worksheet=WORKSHEET_NAME, data=df)
+            fingerprint = table_fingerprint(df)
+            persist_snapshot(df, fingerprint)
+            init_record_summary().apply_delete(old_record, fingerprint)
             return True
         else:
-            st.error("指定されたインデックスが範囲外です")
+            st.error("対象のデータが見つかりません。他の場所で変更された可能性があります。")
             return False
     except Exception as e:
         st.error(f"データの削除に失敗しました: {str(e)}")
@@ -320,22 +401,93 @@ def main():
     # サイドバーでモード選択
     mode = st.sidebar.selectbox(
         "操作を選択してください",
-        ["データ一覧", "新規追加", "編集", "削除", "音声生成"]
+        ["データ一覧", "集計", "新規追加", "編集", "削除", "音声生成"]
     )
     
     # データ取得
     df = get_all_records(conn)
     
+    # 集計を取得（データの内容が変わった場合のみ再集計）
+    summary = init_record_summary()
+    summary.sync(df, df.attrs.get("fingerprint"))
+    
     if mode == "データ一覧":
         st.header("📊 データ一覧")
         if not df.empty:
+            sort_order = st.radio(
+                "並び順",
+                ["登録順", "created_at", "updated_at"],
+                format_func=lambda x: {"登録順": "登録順", "created_at": "作成日時（新しい順）", "updated_at": "更新日時（新しい順）"}[x],
+                horizontal=True
+            )
+            if sort_order != "登録順":
+                # 事前に並べたインデックスを使って並び替える
+                df = df.iloc[sorted_positions(df, summary.sorted_ids(sort_order))]
             st.dataframe(df, use_container_width=True)
         else:
             st.info("データがありません。")
     
+    elif mode == "集計":
+        st.header("📈 集計")
+        
+        if st.button("🔄 再集計"):
+            summary.rebuild(df, df.attrs.get("fingerprint"))
+        
+        # 他のセッションが集計をやり直していても一貫した値で表示するため、コピーを使う
+        view = summary.view()
+        
+        col1, col2, col3 = st.columns(3)
+        col1.metric("レコード数", f"{view['records']:,}")
+        col2.metric("テキスト文字数合計", f"{view['total_chars']:,}")
+        estimated_cost, unknown_chars = estimate_cost(view["voice_chars"])
+        col3.metric(
+            "音声生成の概算費用",
+            f"${estimated_cost:,.2f}",
+            help="音声の種類（Standard / WaveNet / Neural2 / Studioなど）ごとの公開価格から概算しています。"
+        )
+        if unknown_chars:
+            st.caption(f"※ 料金が不明な音声の {unknown_chars:,} 文字は概算に含まれていません。")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.subheader("言語別")
+            language_df = pd.DataFrame({
+                "件数": pd.Series(dict(view["language_counts"]), dtype="int64"),
+                "文字数": pd.Series(dict(view["language_chars"]), dtype="int64")
+            }).fillna(0).astype("int64")
+            language_df.index = [language_label(code) if code else "(未設定)" for code in language_df.index]
+            st.dataframe(language_df, use_container_width=True)
+        
+        with col2:
+            st.subheader("音声別")
+            voice_counts = pd.Series(dict(view["voice_counts"]), name="件数", dtype="int64").sort_values(ascending=False)
+            voice_counts.index = [voice if voice else "(未設定)" for voice in voice_counts.index]
+            st.bar_chart(voice_counts)
+        
+        st.subheader("最近更新されたデータ")
+        recent = view["recent"]
+        if recent:
+            st.dataframe(
+                pd.DataFrame(recent, columns=["title", "language", "voice", "chars", "updated_at"]),
+                use_container_width=True
+            )
+        else:
+            st.info("データがありません。")
+    
     elif mode == "新規追加":
         st.header("➕ 新規データ追加")
         
+        # 音声カタログ取得（キャッシュ済み）
+        voice_catalog = load_voice_catalog(tts_client)
+        
+        # 言語を変えたら音声の選択肢も変わるよう、言語はフォームの外で選ぶ
+        language = st.selectbox(
+            "言語",
+            voice_catalog["languages"],
+            format_func=language_label
+        )
+        
         with st.form("add_form"):
             col1, col2 = st.columns(2)
             
@@ -344,19 +496,7 @@ def main():
                 text_content = st.text_area("テキスト内容", height=150)
             
             with col2:
-                language = st.selectbox(
-                    "言語",
-                    ["ja-JP", "en-US", "en-GB"],
-                    format_func=lambda x: {"ja-JP": "日本語", "en-US": "英語(US)", "en-GB": "英語(UK)"}[x]
-                )
-                
-                voice_options = {
-                    "ja-JP": ["ja-JP-Wavenet-A", "ja-JP-Wavenet-B", "ja-JP-Wavenet-C", "ja-JP-Wavenet-D"],
-                    "en-US": ["en-US-Wavenet-A", "en-US-Wavenet-B", "en-US-Wavenet-C", "en-US-Wavenet-D"],
-                    "en-GB": ["en-GB-Wavenet-A", "en-GB-Wavenet-B", "en-GB-Wavenet-C", "en-GB-Wavenet-D"]
-                }
-                
-                voice = st.selectbox("音声", voice_options[language])
+                voice = st.selectbox("音声", voice_catalog["voices"][language])
             
             submitted = st.form_submit_button("追加")
             
@@ -394,6 +534,18 @@ def main():
             
             selected_record = df.iloc[selected_index]
             
+            # 音声カタログ取得（キャッシュ済み）
+            voice_catalog = load_voice_catalog(tts_client)
+            
+            # 言語を変えたら音声の選択肢も変わるよう、言語はフォームの外で選ぶ
+            current_language = selected_record.get('language', 'ja-JP')
+            language = st.selectbox(
+                "言語",
+                voice_catalog["languages"],
+                index=find_language_index(voice_catalog, current_language),
+                format_func=language_label
+            )
+            
             with st.form("edit_form"):
                 col1, col2 = st.columns(2)
                 
@@ -402,26 +554,12 @@ def main():
                     text_content = st.text_area("テキスト内容", value=selected_record.get('text_content', ''), height=150)
                 
                 with col2:
-                    current_language = selected_record.get('language', 'ja-JP')
-                    language = st.selectbox(
-                        "言語",
-                        ["ja-JP", "en-US", "en-GB"],
-                        index=["ja-JP", "en-US", "en-GB"].index(current_language) if current_language in ["ja-JP", "en-US", "en-GB"] else 0,
-                        format_func=lambda x: {"ja-JP": "日本語", "en-US": "英語(US)", "en-GB": "英語(UK)"}[x]
+                    current_voice = selected_record.get('voice', '')
+                    voice = st.selectbox(
+                        "音声",
+                        voice_catalog["voices"][language],
+                        index=find_voice_index(voice_catalog, language, current_voice)
                     )
-                    
-                    voice_options = {
-                        "ja-JP": ["ja-JP-Wavenet-A", "ja-JP-Wavenet-B", "ja-JP-Wavenet-C", "ja-JP-Wavenet-D"],
-                        "en-US": ["en-US-Wavenet-A", "en-US-Wavenet-B", "en-US-Wavenet-C", "en-US-Wavenet-D"],
-                        "en-GB": ["en-GB-Wavenet-A", "en-GB-Wavenet-B", "en-GB-Wavenet-C", "en-GB-Wavenet-D"]
-                    }
-                    
-                    current_voice = selected_record.get('voice', voice_options[language][0])
-                    voice_index = 0
-                    if current_voice in voice_options[language]:
-                        voice_index = voice_options[language].index(current_voice)
-                    
-                    voice = st.selectbox("音声", voice_options[language], index=voice_index)
                 
                 submitted = st.form_submit_button("更新")
                 
@@ -468,7 +606,7 @@ def main():
             st.write(f"- 作成日時: {selected_record.get('created_at', 'N/A')}")
             
             if st.button("🗑️ 削除実行", type="secondary"):
-                if delete_record(conn, selected_index):
+                if delete_record(conn, selected_index, selected_record):
                     st.success("データが削除されました！")
                     st.rerun()
                 else:
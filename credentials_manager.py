@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""サービスアカウント認証情報と接続を共有するモジュール"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+import streamlit as st
+
+# Google Cloud APIのスコープ
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+# 必須の認証情報キー
+REQUIRED_KEYS = ['client_email', 'private_key', 'project_id']
+
+# 有効期限の何秒前にトークンを更新するか
+TOKEN_REFRESH_MARGIN = 300
+
+# バックグラウンドでトークンを確認する間隔（秒）
+TOKEN_CHECK_INTERVAL = 60
+
+
+def parse_credentials_info(gsheets_info):
+    """secretsのgsheets設定からサービスアカウント情報を取り出す"""
+    # 認証情報を取得する（サーバーとローカルで構造が異なる）
+    credentials_dict = None
+
+    # パターン1: credentialsサブセクションがある場合（ローカル）
+    if 'credentials' in gsheets_info:
+        try:
+            credentials_info = gsheets_info['credentials']
+            if hasattr(credentials_info, 'to_dict'):
+                credentials_dict = credentials_info.to_dict()
+            elif hasattr(credentials_info, '_data'):
+                credentials_dict = dict(credentials_info._data)
+            else:
+                credentials_dict = dict(credentials_info)
+            st.write("🔍 credentialsサブセクションから認証情報を取得しました")
+        except Exception as e:
+            st.write(f"🔍 credentialsサブセクションアクセスエラー: {e}")
+
+    # パターン2: 直接gsheets_infoにサービスアカウント情報がある場合（サーバー）
+    if credentials_dict is None:
+        try:
+            # 必要なキーが直接存在するかチェック
+            if all(key in gsheets_info for key in REQUIRED_KEYS):
+                credentials_dict = dict(gsheets_info)
+                st.write("🔍 直接アクセスから認証情報を取得しました")
+            else:
+                missing_keys = [key for key in REQUIRED_KEYS if key not in gsheets_info]
+                st.write(f"🔍 必要なキーが不足: {missing_keys}")
+        except Exception as e:
+            st.write(f"🔍 直接アクセスエラー: {e}")
+
+    if credentials_dict is None:
+        raise ValueError("認証情報を取得できませんでした")
+
+    # 認証情報をログ出力（プライベートキーは除外）
+    safe_keys = [k for k in credentials_dict.keys() if k != 'private_key']
+    st.write(f"🔍 取得した認証情報のキー: {safe_keys}")
+
+    # 必要なキーの存在確認
+    missing_keys = [key for key in REQUIRED_KEYS if key not in credentials_dict]
+    if missing_keys:
+        raise ValueError(f"必要なキーが不足しています: {missing_keys}")
+
+    return credentials_dict
+
+
+class SharedCredentials:
+    """認証情報とgRPCチャネルをクライアント間で共有する"""
+
+    def __init__(self, credentials_dict):
+        from google.oauth2 import service_account
+        from google.auth.transport.requests import Request
+        import requests
+
+        self.credentials = service_account.Credentials.from_service_account_info(
+            credentials_dict,
+            scopes=SCOPES
+        )
+        self._request = Request(session=requests.Session())
+        self._lock = threading.Lock()
+        # トークン更新中もチャネルを取得できるよう、別のロックを使う
+        self._channels_lock = threading.Lock()
+        self._channels = {}
+        self._stop_event = threading.Event()
+        self._refresher = None
+
+    def needs_refresh(self):
+        """トークンの更新が必要か判定"""
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None:
+            return True
+        # google-authの有効期限はタイムゾーンなしのUTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return expiry - now < timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+    def refresh_if_needed(self):
+        """有効期限が近い場合のみトークンを更新"""
+        with self._lock:
+            if self.needs_refresh():
+                self.credentials.refresh(self._request)
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_if_needed()
+            except Exception as e:
+                # 次回の確認で再試行する
+                print(f"トークンの更新に失敗しました: {e}")
+            self._stop_event.wait(TOKEN_CHECK_INTERVAL)
+
+    def start_refresher(self):
+        """バックグラウンドでトークンの取得・更新を開始"""
+        # 初回の取得もバックグラウンドで行い、失敗してもクライアントの初期化は止めない
+        if self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._refresh_loop,
+                name="credentials-refresher",
+                daemon=True
+            )
+            self._refresher.start()
+
+    def stop_refresher(self):
+        """バックグラウンドでの更新を停止し、gRPCチャネルを閉じる"""
+        self._stop_event.set()
+        with self._channels_lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+        for channel in channels:
+            try:
+                channel.close()
+            except Exception as e:
+                print(f"gRPCチャネルのクローズに失敗しました: {e}")
+
+    def grpc_channel(self, target):
+        """接続先ごとに共有のgRPCチャネルを取得"""
+        from google.api_core import grpc_helpers
+
+        with self._channels_lock:
+            if target not in self._channels:
+                self._channels[target] = grpc_helpers.create_channel(
+                    target,
+                    credentials=self.credentials,
+                    scopes=SCOPES
+                )
+            return self._channels[target]
+
+
+# 現在使用中のインスタンス（キャッシュクリア時に古いスレッドとチャネルを片付ける）
+_active_credentials = None
+
+
+@st.cache_resource
+def get_shared_credentials():
+    """secretsを一度だけ解析し、共有の認証情報を初期化"""
+    global _active_credentials
+
+    gsheets_info = st.secrets["connections"]["gsheets"]
+    shared = SharedCredentials(parse_credentials_info(gsheets_info))
+
+    if _active_credentials is not None:
+        _active_credentials.stop_refresher()
+    _active_credentials = shared
+    shared.start_refresher()
+    return shared
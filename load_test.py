@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""複数のStreamlitセッションを同時に動かしてアプリの負荷を計測するツール
+
+Google SheetsとText-to-Speechは偽のバックエンドに差し替えるため、認証情報なしで実行できる。
+AppTestはプロセス全体で共有する状態を書き換えるため、同時実行するセッションは別々のプロセスで動かす。
+各ワーカープロセスはそれぞれ1台のサーバーに相当し、偽のシートだけを全プロセスで共有する。
+そのため複数サーバーからの同時編集・削除の競合は再現されるが、1つのサーバープロセス内での
+セッションの同時実行（キャッシュや集計のロックの競合）はシミュレートしない。
+
+    python load_test.py --sessions 8 --concurrency 4 --actions 10 --rows 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from types import ModuleType, SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+
+# 画面上のデータ選択のラベル（format_funcを使うため操作前に位置で選び直す）
+RECORD_SELECT_LABELS = [
+    "編集するデータを選択してください",
+    "削除するデータを選択してください",
+    "音声生成するデータを選択してください",
+]
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# サイドバーの操作名とアクション名の対応
+MODES = {
+    "list": "データ一覧",
+    "summary": "集計",
+    "add": "新規追加",
+    "edit": "編集",
+    "delete": "削除",
+    "synthesize": "音声生成",
+}
+
+# アクションの出現比率（一覧表示が中心の利用を想定）
+DEFAULT_MIX = {
+    "list": 45,
+    "summary": 5,
+    "add": 15,
+    "edit": 15,
+    "delete": 5,
+    "synthesize": 15,
+}
+
+# AppTestが再実行の完了を確認する間隔（秒）。既定の0.1秒では計測値が0.1秒刻みになる
+POLL_INTERVAL = 0.005
+
+COLUMNS = ["id", "title", "text_content", "language", "voice", "created_at", "updated_at"]
+
+
+class BackendStats:
+    """偽のバックエンドの呼び出し回数を記録する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+    def record(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+
+class FakeGSheetsConnection:
+    """GSheetsConnectionの代わりに全プロセスで共有するDataFrameを読み書きする
+
+    本物と同じく読み込み結果をttl秒間プロセス内にキャッシュし、書き込んでもキャッシュは消さない。
+    """
+
+    def __init__(self, stats, sheet, sheet_lock, latency=0.0):
+        self._stats = stats
+        self._sheet = sheet
+        self._sheet_lock = sheet_lock
+        self._latency = latency
+        self._cache_lock = threading.Lock()
+        self._cache = {}
+
+    def read(self, worksheet=None, usecols=None, ttl=None, **kwargs):
+        key = (worksheet, tuple(usecols or ()), ttl)
+        if ttl:
+            with self._cache_lock:
+                cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < ttl:
+                self._stats.record("sheets.read (cached)")
+                return cached[1].copy()
+
+        self._stats.record("sheets.read")
+        time.sleep(self._latency)
+        with self._sheet_lock:
+            df = self._sheet["df"]
+        if ttl:
+            with self._cache_lock:
+                self._cache[key] = (time.monotonic(), df)
+        return df.copy()
+
+    def update(self, worksheet=None, data=None, **kwargs):
+        self._stats.record("sheets.update")
+        time.sleep(self._latency)
+        with self._sheet_lock:
+            self._sheet["df"] = data.reset_index(drop=True).copy()
+        return data
+
+
+class FakeTTSClient:
+    """TextToSpeechClientの代わりに固定の音声データを返す"""
+
+    def __init__(self, stats, latency=0.0):
+        self._stats = stats
+        self._latency = latency
+
+    def list_voices(self, *args, **kwargs):
+        self._stats.record("tts.list_voices")
+        time.sleep(self._latency)
+        voices = [
+            SimpleNamespace(name=f"{code}-Wavenet-{suffix}", language_codes=[code])
+            for code in ["ja-JP", "en-US", "en-GB"]
+            for suffix in "ABCD"
+        ]
+        return SimpleNamespace(voices=voices)
+
+    def synthesize_speech(self, *args, **kwargs):
+        self._stats.record("tts.synthesize_speech")
+        time.sleep(self._latency)
+        return SimpleNamespace(audio_content=b"ID3" + b"\x00" * 1024)
+
+
+def make_record(i):
+    """テスト用のレコードを作成"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "id": str(uuid.uuid4()),
+        "title": f"負荷テスト {i}",
+        "text_content": "これは負荷テスト用のテキストです。" * 3,
+        "language": "ja-JP",
+        "voice": "ja-JP-Wavenet-A",
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def install_fakes(conn, tts_client):
+    """アプリが使う外部接続を偽のバックエンドに差し替える"""
+    import streamlit as st
+    import credentials_manager
+    from google.cloud import texttospeech
+    from google.cloud.texttospeech_v1.services.text_to_speech import transports
+
+    # st-gsheets-connectionが未インストールでもアプリのインポートが通るようにする
+    try:
+        import streamlit_gsheets  # noqa: F401
+    except ImportError:
+        stub = ModuleType("streamlit_gsheets")
+        stub.GSheetsConnection = FakeGSheetsConnection
+        sys.modules["streamlit_gsheets"] = stub
+
+    real_connection = st.connection
+
+    def fake_connection(name, type=None, **kwargs):
+        if name == "gsheets":
+            return conn
+        return real_connection(name, type=type, **kwargs)
+
+    shared = SimpleNamespace(grpc_channel=lambda target: None)
+    patches = [
+        mock.patch.object(st, "connection", fake_connection),
+        # AppTest（1.28）はボタン押下直後のst.rerunで同じ送信を繰り返してしまうため、
+        # 再実行は行わず結果の画面をそのまま計測する（更新後の表示は次のアクションで計測される）
+        mock.patch.object(st, "rerun", lambda: None),
+        mock.patch.object(credentials_manager, "get_shared_credentials", lambda: shared),
+        mock.patch.object(transports, "TextToSpeechGrpcTransport", lambda channel=None: None),
+        mock.patch.object(texttospeech, "TextToSpeechClient", lambda **kwargs: tts_client),
+    ]
+    for patcher in patches:
+        patcher.start()
+    return patches
+
+
+class ActionFailed(Exception):
+    """アクションが画面上で完了しなかった"""
+
+
+class ActionConflict(ActionFailed):
+    """対象のデータが他のセッションで変更・削除されていた"""
+
+
+# 他のセッションと競合したときにアプリが表示するメッセージ
+CONFLICT_MESSAGE = "対象のデータが見つかりません。他の場所で変更された可能性があります。"
+
+
+def find_by_label(elements, label):
+    """ラベルが一致する最初の要素を取得（見つからない場合はNone）"""
+    for element in elements:
+        if element.label == label:
+            return element
+    return None
+
+
+def require(elements, label):
+    """ラベルが一致する要素を取得（見つからない場合はActionFailed）"""
+    element = find_by_label(elements, label)
+    if element is None:
+        raise ActionFailed(f"'{label}' が画面にありません")
+    return element
+
+
+def pin_formatted_widgets(at):
+    """format_funcを使う選択肢を位置で選び直す
+
+    AppTestは選択中の値を表示文字列で探すため、format_funcで表示を変えた選択肢は
+    そのままでは再実行できない。元の値が位置（データ選択のrange）ならその位置を、
+    それ以外は初期位置を選ぶ。
+    """
+    for widget in [*at.selectbox, *at.radio]:
+        try:
+            widget.index
+        except ValueError:
+            value = widget.value
+            if isinstance(value, int) and 0 <= value < len(widget.options):
+                widget.select_index(value)
+            else:
+                widget.select_index(widget.proto.default)
+
+
+def timed_run(at, timeout):
+    """スクリプトを再実行し、所要時間（秒）を返す（例外が表示された場合はActionFailed）"""
+    pin_formatted_widgets(at)
+    start = time.perf_counter()
+    at.run(timeout=timeout)
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise ActionFailed(at.exception[0].message)
+    return elapsed
+
+
+def expect_success(at, message):
+    """成功メッセージが表示されたか確認（表示されていない場合はActionFailed）"""
+    if not any(element.value == message for element in at.success):
+        errors = [element.value for element in at.error]
+        if CONFLICT_MESSAGE in errors:
+            raise ActionConflict(f"'{message}' が表示されませんでした: {errors}")
+        raise ActionFailed(f"'{message}' が表示されませんでした: {errors}")
+
+
+def select_mode(at, mode, timeout):
+    """サイドバーで操作を選択して再実行"""
+    require(at.selectbox, "操作を選択してください").set_value(mode)
+    return timed_run(at, timeout)
+
+
+def select_random_record(at, rng, timeout):
+    """データ選択があればランダムな行を選んで再実行（データがなければFalse）"""
+    for label in RECORD_SELECT_LABELS:
+        selectbox = find_by_label(at.selectbox, label)
+        if selectbox is not None:
+            selectbox.select_index(rng.randrange(len(selectbox.options)))
+            return timed_run(at, timeout)
+    return None
+
+
+def perform_action(at, action, rng, timeout):
+    """1つのアクションを実行し、各再実行の所要時間を返す"""
+    latencies = [select_mode(at, MODES[action], timeout)]
+
+    if action in ("edit", "delete", "synthesize"):
+        latency = select_random_record(at, rng, timeout)
+        if latency is None:
+            # データがない場合は画面表示のみ計測する
+            return latencies
+        latencies.append(latency)
+
+    if action == "add":
+        require(at.text_input, "タイトル").input(f"負荷テスト {rng.randrange(10**6)}")
+        require(at.text_area, "テキスト内容").input("負荷テストで追加したテキストです。")
+        require(at.button, "追加").click()
+        latencies.append(timed_run(at, timeout))
+        expect_success(at, "データが追加されました！")
+
+    elif action == "edit":
+        require(at.text_input, "タイトル").input(f"編集済み {rng.randrange(10**6)}")
+        require(at.button, "更新").click()
+        latencies.append(timed_run(at, timeout))
+        expect_success(at, "データが更新されました！")
+
+    elif action == "delete":
+        require(at.button, "🗑️ 削除実行").click()
+        latencies.append(timed_run(at, timeout))
+        expect_success(at, "データが削除されました！")
+
+    elif action == "synthesize":
+        require(at.button, "🎵 音声生成").click()
+        latencies.append(timed_run(at, timeout))
+        expect_success(at, "音声が生成されました！")
+
+    return latencies
+
+
+def wait_for_shutdown(runner, timeout=3):
+    """スクリプトの実行スレッドが終了するまで待つ（AppTestの待機処理の代わり）"""
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+
+    start = time.time()
+    while time.time() - start < timeout:
+        time.sleep(POLL_INTERVAL)
+        # AppTestは最後のイベントがSHUTDOWNであることを前提にしている
+        if ScriptRunnerEvent.SHUTDOWN in runner.events:
+            return
+
+    runner.request_stop()
+    runner.join()
+    raise RuntimeError(f"AppTest script run timed out after {timeout}s")
+
+
+# ワーカープロセスごとの偽のバックエンド
+_worker_stats = None
+
+
+def init_worker(args, sheet, sheet_lock):
+    """ワーカープロセスで偽のバックエンドを準備（sheetは全プロセスで共有する）"""
+    global _worker_stats
+
+    # スナップショットはプロセスごとの一時ディレクトリに書き込む（アプリのインポート前に設定する）
+    os.environ["SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="load_test_snapshot_")
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+
+    _worker_stats = BackendStats()
+    conn = FakeGSheetsConnection(_worker_stats, sheet, sheet_lock, latency=args.sheets_latency)
+    tts_client = FakeTTSClient(_worker_stats, latency=args.tts_latency)
+    install_fakes(conn, tts_client)
+
+    # 再実行の完了を細かい間隔で確認し、計測値の丸めを防ぐ
+    from streamlit.testing.v1 import local_script_runner
+    local_script_runner.require_widgets_deltas = wait_for_shutdown
+
+
+def run_session(session_id, args, mix):
+    """1セッション分のアクションを順に実行（ワーカープロセス内で呼ばれる）"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed + session_id)
+    actions = list(mix)
+    weights = [mix[action] for action in actions]
+    calls_before = Counter(_worker_stats.calls)
+
+    result = {"latencies": defaultdict(list), "errors": [], "conflicts": 0, "completed": 0, "fatal": None}
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    try:
+        result["latencies"]["initial"].append(timed_run(at, args.timeout))
+    except Exception as e:
+        result["fatal"] = f"初回表示に失敗しました: {e}"
+        result["calls"] = _worker_stats.calls - calls_before
+        return result
+
+    for _ in range(args.actions):
+        action = rng.choices(actions, weights)[0]
+        try:
+            result["latencies"][action].extend(perform_action(at, action, rng, args.timeout))
+            result["completed"] += 1
+        except ActionConflict:
+            # 他のセッションとの競合は想定内のため、失敗とは分けて数える（画面はそのまま使える）
+            result["conflicts"] += 1
+        except Exception as e:
+            result["errors"].append(f"{action}: {e}")
+            # 次のアクションのため画面を作り直す
+            at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+            try:
+                timed_run(at, args.timeout)
+            except Exception:
+                pass
+
+    result["calls"] = _worker_stats.calls - calls_before
+    return result
+
+
+def percentile(values, pct):
+    """最近傍順位法でパーセンタイルを計算"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def print_report(results, elapsed, args):
+    """計測結果を表示"""
+    latencies = defaultdict(list)
+    calls = Counter()
+    errors = 0
+    conflicts = 0
+    completed = 0
+    for result in results:
+        errors += len(result["errors"])
+        conflicts += result["conflicts"]
+        completed += result["completed"]
+        calls += result["calls"]
+        for action, values in result["latencies"].items():
+            latencies[action].extend(values)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    reruns = len(all_latencies)
+
+    print(f"セッション数: {args.sessions}（同時実行 {args.concurrency}プロセス、シートのみ共有）")
+    print("※ 各プロセスは別々のサーバーに相当し、1つのサーバープロセス内でのセッションの同時実行はシミュレートしていません")
+    print(f"アクション: 成功 {completed} / 競合 {conflicts} / 失敗 {errors}  再実行回数: {reruns}")
+    print(f"経過時間: {elapsed:.2f}s  スループット: {reruns / elapsed:.2f} reruns/s")
+    print()
+    print(f"{'action':<12}{'count':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for action in ["initial", *MODES, "all"]:
+        values = all_latencies if action == "all" else latencies.get(action, [])
+        if not values:
+            continue
+        print(
+            f"{action:<12}{len(values):>8}"
+            f"{percentile(values, 50) * 1000:>10.1f}"
+            f"{percentile(values, 90) * 1000:>10.1f}"
+            f"{percentile(values, 99) * 1000:>10.1f}"
+            f"{max(values) * 1000:>10.1f}"
+        )
+    print()
+    print("バックエンド呼び出し回数:")
+    for name, count in sorted(calls.items()):
+        print(f"  {name:<24}{count:>8}  ({count / max(reruns, 1):.2f} / rerun)")
+
+
+def parse_mix(text):
+    """'list=50,add=10' 形式のアクション比率を解析"""
+    mix = {}
+    for item in text.split(","):
+        action, _, weight = item.partition("=")
+        action = action.strip()
+        if action not in MODES:
+            raise argparse.ArgumentTypeError(f"不明なアクションです: {action}")
+        mix[action] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamlitアプリの同時セッション負荷テスト")
+    parser.add_argument("--sessions", type=int, default=20, help="シミュレートするセッション数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行するセッション数（ワーカープロセス数）")
+    parser.add_argument("--actions", type=int, default=10, help="1セッションあたりのアクション数")
+    parser.add_argument("--rows", type=int, default=100, help="シートの初期行数")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="Sheets呼び出しの擬似遅延（秒）")
+    parser.add_argument("--tts-latency", type=float, default=0.2, help="TTS呼び出しの擬似遅延（秒）")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="アクション比率（例: list=45,summary=5,add=10,edit=10,delete=5,synthesize=25）")
+    parser.add_argument("--timeout", type=float, default=30, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    args = parser.parse_args()
+    args.concurrency = min(args.concurrency, args.sessions)
+
+    # AppTestはワーカー内の__main__をアプリに置き換えるため、関数はモジュール名で参照させる
+    import load_test
+
+    context = get_context("spawn")
+    with context.Manager() as manager:
+        # 偽のシートは全ワーカーで共有し、別サーバーからの同時編集を再現する
+        sheet = manager.dict()
+        sheet["df"] = pd.DataFrame([make_record(i) for i in range(args.rows)], columns=COLUMNS)
+        sheet_lock = manager.Lock()
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=args.concurrency,
+            mp_context=context,
+            initializer=load_test.init_worker,
+            initargs=(args, sheet, sheet_lock)
+        ) as executor:
+            futures = [executor.submit(load_test.run_session, i, args, args.mix) for i in range(args.sessions)]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+    print_report(results, elapsed, args)
+
+    # 失敗したアクションの内容を表示
+    errors = [(i, error) for i, result in enumerate(results) for error in result["errors"]]
+    for session_id, error in errors[:20]:
+        print(f"セッション{session_id}: {error}", file=sys.stderr)
+
+    # 初回表示の失敗や、すべてのアクションの失敗は計測として無効
+    fatal = [(i, result["fatal"]) for i, result in enumerate(results) if result["fatal"]]
+    for session_id, message in fatal:
+        print(f"セッション{session_id}: {message}", file=sys.stderr)
+    if fatal or not any(result["completed"] for result in results):
+        print("負荷テストを完了できませんでした。", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
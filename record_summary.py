@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""レコードの集計値と並び順を差分更新で保持するモジュール"""
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+import pandas as pd
+
+
+def _text(value):
+    """NaNや空欄を空文字として扱う"""
+    if value is None or pd.isna(value):
+        return ''
+    return str(value)
+
+
+class RecordSummary:
+    """言語・音声ごとの件数や文字数、日時順のインデックスを保持する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        # 集計元データのウォーターマーク（内容が変わったかの判定に使う）
+        self.fingerprint = None
+        # idが重複・欠落していて仮のidを振った行があるか（差分更新では特定できない）
+        self.has_row_ids = False
+        self.records = {}
+        self.language_counts = Counter()
+        self.voice_counts = Counter()
+        self.language_chars = Counter()
+        self.voice_chars = Counter()
+        self.total_chars = 0
+        # (日時, id) の昇順リスト
+        self.created_order = []
+        self.updated_order = []
+
+    def _entry(self, record):
+        return {
+            "title": _text(record.get('title')),
+            "language": _text(record.get('language')),
+            "voice": _text(record.get('voice')),
+            "chars": len(_text(record.get('text_content'))),
+            "created_at": _text(record.get('created_at')),
+            "updated_at": _text(record.get('updated_at')),
+        }
+
+    def _add(self, record_id, entry):
+        self._remove(record_id)
+        self.records[record_id] = entry
+        self.language_counts[entry["language"]] += 1
+        self.voice_counts[entry["voice"]] += 1
+        self.language_chars[entry["language"]] += entry["chars"]
+        self.voice_chars[entry["voice"]] += entry["chars"]
+        self.total_chars += entry["chars"]
+        insort(self.created_order, (entry["created_at"], record_id))
+        insort(self.updated_order, (entry["updated_at"], record_id))
+
+    def _remove(self, record_id):
+        entry = self.records.pop(record_id, None)
+        if entry is None:
+            return
+        self.language_counts[entry["language"]] -= 1
+        self.voice_counts[entry["voice"]] -= 1
+        self.language_chars[entry["language"]] -= entry["chars"]
+        self.voice_chars[entry["voice"]] -= entry["chars"]
+        self.total_chars -= entry["chars"]
+        # 0件になった項目は表示しない
+        self.language_counts += Counter()
+        self.voice_counts += Counter()
+        self.language_chars += Counter()
+        self.voice_chars += Counter()
+        for order, key in ((self.created_order, entry["created_at"]), (self.updated_order, entry["updated_at"])):
+            i = bisect_left(order, (key, record_id))
+            if i < len(order) and order[i] == (key, record_id):
+                del order[i]
+
+    def rebuild(self, df, fingerprint=None):
+        """DataFrame全体から集計をやり直す"""
+        with self._lock:
+            self._clear()
+            self.fingerprint = fingerprint
+            for record in df.to_dict('records'):
+                record_id = _text(record.get('id'))
+                # idが重複・欠落している行は別レコードとして扱う
+                if not record_id or record_id in self.records:
+                    record_id = f"row-{len(self.records)}"
+                    self.has_row_ids = True
+                self._add(record_id, self._entry(record))
+
+    def sync(self, df, fingerprint):
+        """集計元とウォーターマークが異なる場合のみ集計をやり直す"""
+        with self._lock:
+            if fingerprint is not None and fingerprint == self.fingerprint:
+                return
+        self.rebuild(df, fingerprint)
+
+    def _invalidate(self):
+        # 差分で反映できない変更は、次回のsyncで集計をやり直す
+        self.fingerprint = None
+
+    def apply_add(self, record, fingerprint=None):
+        """追加されたレコードを集計に反映（fingerprintは書き込み後のデータのもの）"""
+        record_id = _text(record.get('id'))
+        with self._lock:
+            if self.has_row_ids or not record_id or record_id in self.records:
+                self._invalidate()
+                return
+            self._add(record_id, self._entry(record))
+            self.fingerprint = fingerprint
+
+    def apply_update(self, old_record, new_record, fingerprint=None):
+        """更新されたレコードを集計に反映（fingerprintは書き込み後のデータのもの）"""
+        old_id = _text(old_record.get('id'))
+        new_id = _text(new_record.get('id'))
+        with self._lock:
+            if self.has_row_ids or not old_id or old_id not in self.records or (new_id != old_id and new_id in self.records):
+                self._invalidate()
+                return
+            self._remove(old_id)
+            self._add(new_id or old_id, self._entry(new_record))
+            self.fingerprint = fingerprint
+
+    def apply_delete(self, record, fingerprint=None):
+        """削除されたレコードを集計から除く（fingerprintは書き込み後のデータのもの）"""
+        record_id = _text(record.get('id'))
+        with self._lock:
+            if self.has_row_ids or not record_id or record_id not in self.records:
+                self._invalidate()
+                return
+            self._remove(record_id)
+            self.fingerprint = fingerprint
+
+    def view(self, limit=10):
+        """画面表示用に集計値のコピーを取得（集計のやり直し中でも一貫した値を返す）"""
+        with self._lock:
+            return {
+                "records": len(self.records),
+                "total_chars": self.total_chars,
+                "language_counts": Counter(self.language_counts),
+                "language_chars": Counter(self.language_chars),
+                "voice_counts": Counter(self.voice_counts),
+                "voice_chars": Counter(self.voice_chars),
+                "recent": [dict(self.records[record_id], id=record_id) for _, record_id in reversed(self.updated_order[-limit:])],
+            }
+
+    def recent(self, column, limit=10):
+        """日時の新しい順にレコードを取得"""
+        with self._lock:
+            # 集計のやり直しでリストが置き換わるため、ロック内で参照する
+            order = self.created_order if column == 'created_at' else self.updated_order
+            return [dict(self.records[record_id], id=record_id) for _, record_id in reversed(order[-limit:])]
+
+    def sorted_ids(self, column, descending=True):
+        """日時順に並べたidの一覧を取得"""
+        with self._lock:
+            # 集計のやり直しでリストが置き換わるため、ロック内で参照する
+            order = self.created_order if column == 'created_at' else self.updated_order
+            ids = [record_id for _, record_id in order]
+        return ids[::-1] if descending else ids
+
+
+def sorted_positions(df, ids):
+    """idの並び順に対応する行位置を取得（見つからない行は元の順で末尾に並べる）"""
+    if 'id' not in df.columns:
+        return list(range(len(df)))
+
+    positions = {}
+    for i, record_id in enumerate(df['id']):
+        positions.setdefault(_text(record_id), i)
+
+    ordered = [positions[record_id] for record_id in ids if record_id in positions]
+    seen = set(ordered)
+    ordered += [i for i in range(len(df)) if i not in seen]
+    return ordered
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""最後に読み込んだシートをディスクに保存し、起動直後の表示に使うモジュール"""
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+
+# スナップショットの保存先（環境変数で変更可能）
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot"))
+
+# Arrowのスキーマメタデータに同期情報を保存するキー
+META_KEY = b"snapshot"
+
+
+def _snapshot_path(worksheet_name):
+    """ワークシートごとのスナップショットのパスを取得"""
+    # ワークシート名はファイル名に使えない文字を含む可能性があるため16進数にする
+    key = worksheet_name.encode("utf-8").hex()
+    return os.path.join(SNAPSHOT_DIR, f"{key}.feather")
+
+
+def table_fingerprint(df):
+    """データの内容を表すウォーターマーク（行数と内容のハッシュ）を計算"""
+    digest = hashlib.sha1()
+    digest.update(json.dumps([str(col) for col in df.columns], ensure_ascii=False).encode("utf-8"))
+    if not df.empty:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return f"{len(df)}:{digest.hexdigest()}"
+
+
+def save_snapshot(df, worksheet_name, fingerprint=None):
+    """DataFrameと同期情報（ウォーターマーク）を1つのファイルに保存"""
+    import pyarrow as pa
+    from pyarrow import feather
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    data_path = _snapshot_path(worksheet_name)
+
+    # Featherは文字列のカラム名と連番のインデックスが必要
+    snapshot_df = df.reset_index(drop=True)
+    snapshot_df.columns = [str(col) for col in snapshot_df.columns]
+
+    meta = {
+        "worksheet": worksheet_name,
+        "synced_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": len(snapshot_df),
+        "fingerprint": fingerprint or table_fingerprint(snapshot_df),
+    }
+
+    # 同期情報はスキーマのメタデータに入れ、データと常に一緒に置き換わるようにする
+    table = pa.Table.from_pandas(snapshot_df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[META_KEY] = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+
+    # 書き込み途中のファイルを読まないよう、書き込みごとに別の一時ファイルから置き換える
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # 非圧縮にしてメモリマップでそのまま読めるようにする
+            feather.write_feather(table, f, compression="uncompressed")
+        os.replace(tmp_path, data_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return meta
+
+
+def load_snapshot(worksheet_name):
+    """保存済みのDataFrameとメタ情報を読み込む（存在しない場合はNone）"""
+    data_path = _snapshot_path(worksheet_name)
+    if not os.path.exists(data_path):
+        return None, None
+
+    try:
+        from pyarrow import feather
+
+        # メモリマップで読み込み、サイズに依存せず高速に開く
+        table = feather.read_table(data_path, memory_map=True)
+        meta = json.loads((table.schema.metadata or {})[META_KEY].decode("utf-8"))
+        return table.to_pandas(), meta
+    except Exception as e:
+        print(f"スナップショットの読み込みに失敗しました: {e}")
+        return None, None
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""音声カタログ（言語・音声の選択肢）を管理するモジュール"""
+import streamlit as st
+
+# カタログのキャッシュ有効期間（秒）
+VOICE_CATALOG_TTL = 3600
+
+# 言語の表示名（未登録の言語は言語コードをそのまま表示）
+LANGUAGE_LABELS = {
+    "ja-JP": "日本語",
+    "en-US": "英語(US)",
+    "en-GB": "英語(UK)",
+}
+
+# オフライン時に使用する同梱のスナップショット
+FALLBACK_VOICES = {
+    "ja-JP": ["ja-JP-Wavenet-A", "ja-JP-Wavenet-B", "ja-JP-Wavenet-C", "ja-JP-Wavenet-D"],
+    "en-US": ["en-US-Wavenet-A", "en-US-Wavenet-B", "en-US-Wavenet-C", "en-US-Wavenet-D"],
+    "en-GB": ["en-GB-Wavenet-A", "en-GB-Wavenet-B", "en-GB-Wavenet-C", "en-GB-Wavenet-D"],
+}
+
+# 音声の種類ごとの料金（USD / 100万文字、公開価格を基にした概算用）
+VOICE_FAMILY_PRICES = {
+    "Standard": 4.0,
+    "Wavenet": 16.0,
+    "Neural2": 16.0,
+    "Polyglot": 16.0,
+    "News": 16.0,
+    "Journey": 30.0,
+    "Chirp": 30.0,
+    "Chirp3": 30.0,
+    "Studio": 160.0,
+}
+
+
+def build_catalog(voices_by_language):
+    """言語ごとの音声一覧から検索用テーブルを事前計算する"""
+    # よく使う言語を先頭に、それ以外は言語コード順に並べる
+    languages = [code for code in LANGUAGE_LABELS if voices_by_language.get(code)]
+    languages += sorted(code for code in voices_by_language if code not in LANGUAGE_LABELS and voices_by_language[code])
+
+    voices = {code: sorted(voices_by_language[code]) for code in languages}
+
+    return {
+        "languages": languages,
+        "voices": voices,
+        "language_index": {code: i for i, code in enumerate(languages)},
+        "voice_index": {code: {name: i for i, name in enumerate(names)} for code, names in voices.items()},
+    }
+
+
+def fetch_voices(tts_client):
+    """Text-to-Speech APIから言語ごとの音声一覧を取得"""
+    response = tts_client.list_voices()
+
+    voices_by_language = {}
+    for voice in response.voices:
+        for language_code in voice.language_codes:
+            voices_by_language.setdefault(language_code, []).append(voice.name)
+    return voices_by_language
+
+
+@st.cache_data(ttl=VOICE_CATALOG_TTL, show_spinner=False)
+def load_voice_catalog(_tts_client):
+    """音声カタログを読み込む（取得できない場合は同梱のスナップショットを使用）"""
+    if _tts_client is not None:
+        try:
+            voices_by_language = fetch_voices(_tts_client)
+            if voices_by_language:
+                return build_catalog(voices_by_language)
+        except Exception as e:
+            st.write(f"🔍 音声一覧の取得に失敗したため同梱の一覧を使用します: {e}")
+
+    return build_catalog(FALLBACK_VOICES)
+
+
+def language_label(language_code):
+    """言語コードの表示名を取得"""
+    return LANGUAGE_LABELS.get(language_code, language_code)
+
+
+def find_language_index(catalog, language_code):
+    """言語コードの選択肢内の位置を取得（見つからない場合は0）"""
+    return catalog["language_index"].get(language_code, 0)
+
+
+def find_voice_index(catalog, language_code, voice_name):
+    """音声名の選択肢内の位置を取得（見つからない場合は0）"""
+    return catalog["voice_index"].get(language_code, {}).get(voice_name, 0)
+
+
+def voice_family(voice_name):
+    """音声名から種類を取得（例: ja-JP-Wavenet-A → Wavenet）"""
+    parts = voice_name.split("-")
+    return parts[2] if len(parts) > 2 else ""
+
+
+def estimate_cost(voice_chars):
+    """音声ごとの文字数から料金を概算（料金が不明な音声の文字数も返す）"""
+    cost = 0.0
+    unknown_chars = 0
+    for voice_name, chars in voice_chars.items():
+        price = VOICE_FAMILY_PRICES.get(voice_family(voice_name))
+        if price is None:
+            unknown_chars += chars
+        else:
+            cost += chars / 1_000_000 * price
+    return cost, unknown_chars